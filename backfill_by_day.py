@@ -1,160 +1,176 @@
 import argparse
-import asyncio
-import requests
-from datetime import datetime, timedelta
-from requests.auth import HTTPBasicAuth
-from playwright.async_api import async_playwright
-from PyTado.interface import Tado
+import functools
+import itertools
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from octopus_tado_common import (
+    PAYMENT_METHODS,
+    OctopusApiError,
+    filter_payment_method,
+    get_consumption_pages,
+    get_gas_rates,
+    rate_period,
+    send_rate_to_tado,
+    send_reading_to_tado,
+    tado_login,
+)
+
+logger = logging.getLogger(__name__)
+
+SENT_CACHE_PATH = Path("/tmp/tado_sent_cache.json")
 
 
-async def browser_login(url, username, password):
+def get_meter_reading_total_consumption(
+    api_key, mprn, gas_serial_number, period_from=None
+):
     """
-    Performs browser-based login to Tado using Playwright.
+    Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True
-        )  # Set to True if you don't want a browser window
-        context = await browser.new_context()
-        page = await context.new_page()
-
-        await page.goto(url)
+    if period_from is None:
+        period_from = datetime(2000, 1, 1, 0, 0, 0)
+    consumption = []
 
-        # Click the "Submit" button before login
-        await page.wait_for_selector('text="Submit"', timeout=5000)
-        await page.click('text="Submit"')
+    # Pages are in date order, so the running totals stay correct for whatever was retrieved
+    try:
+        for page in get_consumption_pages(
+            api_key,
+            mprn,
+            gas_serial_number,
+            group_by="day",
+            order_by="period",
+            period_from=f"{period_from.isoformat()}Z",
+        ):
+            consumption.extend(page["results"])
+    except OctopusApiError as e:
+        logger.warning("%s, continuing with the data retrieved so far", e)
+
+    logger.info("Consumption data retrieved: %d records", len(consumption))
+    return consumption
 
-        # Wait for the login form to appear
-        await page.wait_for_selector('input[name="loginId"]')
 
-        # Replace with actual selectors for your site
-        await page.fill('input[id="loginId"]', username)
-        await page.fill('input[name="password"]', password)
+def collapse_rates(rates):
+    """
+    Reduces Octopus rates to the fewest periods Tado needs. Duplicate rates are dropped
+    and back-to-back rates with the same price and payment method are merged into a single
+    period. The open-ended current rate (valid_to of None) is never merged.
+    """
+    collapsed = []
+    seen = set()
+    # Latest period per payment method, the only one the next rate can extend
+    latest = {}
+
+    for rate in sorted(rates, key=lambda rate: rate["valid_from"]):
+        payment_method = rate.get("payment_method")
+        price = round(rate["value_inc_vat"], 4)
+        key = (payment_method, rate["valid_from"], rate["valid_to"], price)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        previous = latest.get(payment_method)
+        if (
+            previous is not None
+            and previous["valid_to"] is not None
+            and rate["valid_to"] is not None
+            and previous["valid_to"] == rate["valid_from"]
+            and round(previous["value_inc_vat"], 4) == price
+        ):
+            previous["valid_to"] = rate["valid_to"]
+        else:
+            latest[payment_method] = dict(rate)
+            collapsed.append(latest[payment_method])
 
-        await page.click('button.c-btn--primary:has-text("Sign in")')
+    return collapsed
 
-        # Optionally take a screenshot
-        await page.screenshot(path="screenshot.png")
 
-        await page.wait_for_selector(
-            ".text-center.message-screen.b-bubble-screen__spaced", timeout=10000
+def rate_periods(rates):
+    """
+    Returns the (valid_from, valid_to, rate, payment_method) periods to send to Tado for the given rates.
+    """
+    periods = []
+    for rate in rates:
+        date_from, date_to = rate_period(rate)
+        periods.append(
+            (date_from, date_to, rate["value_inc_vat"], rate.get("payment_method"))
         )
+    return periods
 
-        # Take a screenshot (optional)
-        await page.screenshot(path="after-message.png")
-        await browser.close()
 
-
-def tado_login(username, password):
+def send_unsent_to_tado(kind, items, sent, send):
     """
-    Logs into Tado using device activation with browser login if needed.
+    Sends (key, value, args) items to Tado with send(*args), skipping those whose value is already
+    recorded under key in sent and recording those that are sent successfully. Items go one at a
+    time, as PyTado's client can't be shared between threads.
     """
-    tado = Tado(token_file_path="/tmp/tado_refresh_token")
-
-    status = tado.device_activation_status()
-
-    if status == "PENDING":
-        url = tado.device_verification_url()
-
-        asyncio.run(browser_login(url, username, password))
-
-        tado.device_activation()
-
-        status = tado.device_activation_status()
-
-    if status == "COMPLETED":
-        print("Login successful")
-    else:
-        print(f"Login status is {status}")
+    unsent = [
+        (key, value, args) for key, value, args in items if sent.get(key) != value
+    ]
+    logger.info("%d of %d %s not yet sent to Tado", len(unsent), len(items), kind)
 
-    return tado
+    for key, value, args in unsent:
+        if send(*args):
+            sent[key] = value
 
 
-def get_meter_reading_total_consumption(
-    api_key, mprn, gas_serial_number, period_from=None
-):
+def send_rates_to_tado(tado, periods, sent_rates):
     """
-    Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
+    Sends (valid_from, valid_to, rate, payment_method) periods to Tado, skipping those in sent_rates.
     """
-    if period_from is None:
-        period_from = datetime(2000, 1, 1, 0, 0, 0)
-    url = f"https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/?group_by=day&order_by=period&period_from={period_from.isoformat()}Z"
-    consumption = []
-
-    while url:
-        try:
-            response = requests.get(url, auth=HTTPBasicAuth(api_key, ""))
-
-            if response.status_code == 200:
-                meter_readings = response.json()
-                consumption = consumption + meter_readings["results"]
-                url = meter_readings.get("next", "")
-            else:
-                print(
-                    f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}"
-                )
-                break
-        except Exception as e:
-            print(f"Error fetching meter readings: {e}")
-            break
-
-    print(f"Consumption data retrieved: {len(consumption)} records")
-    return consumption
+    items = [
+        (
+            f"{valid_from}/{valid_to}/{payment_method or ''}",
+            rate,
+            (valid_from, valid_to, rate),
+        )
+        for valid_from, valid_to, rate, payment_method in periods
+    ]
+    send_unsent_to_tado(
+        "rates", items, sent_rates, functools.partial(send_rate_to_tado, tado)
+    )
 
 
-def get_gas_rates(api_key, short_code, long_code):
+def send_readings_to_tado(tado, readings, sent_readings):
     """
-    Retrieves all rates from the Octopus Energy API for the given gas product.
+    Sends (date, reading) pairs to Tado, skipping those in sent_readings.
     """
-    url = f"https://api.octopus.energy/v1/products/{short_code}/gas-tariffs/{long_code}/standard-unit-rates/"
-    rates = []
-
-    try:
-        response = requests.get(url, auth=HTTPBasicAuth(api_key, ""))
-
-        if response.status_code == 200:
-            rates_data = response.json()
-            rates = rates_data["results"]
-        else:
-            print(
-                f"Failed to retrieve rates. Status code: {response.status_code}, Message: {response.text}"
-            )
-    except Exception as e:
-        print(f"Error fetching gas rates: {e}")
-
-    return rates
+    items = [
+        (reading_date, int(reading), (reading_date, reading))
+        for reading_date, reading in readings
+    ]
+    send_unsent_to_tado(
+        "meter readings",
+        items,
+        sent_readings,
+        functools.partial(send_reading_to_tado, tado),
+    )
 
 
-def send_rate_to_tado(tado, valid_from, valid_to, rate):
+def load_sent_cache():
     """
-    Sends a gas rate to Tado using its Energy IQ feature.
+    Loads the record of rates and readings already sent to Tado by previous runs.
     """
     try:
-        result = tado.set_eiq_tariff(
-            from_date=valid_from,
-            to_date=valid_to,
-            is_period=True,
-            tariff=(rate / 100),
-            unit="kWh",
-        )
-        print(f"Rate sent successfully for {valid_from} to {valid_to}: {result}")
-        return True
-    except Exception as e:
-        print(f"Error sending rate for {valid_from} to {valid_to}: {e}")
-        return False
+        with SENT_CACHE_PATH.open() as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    cache.setdefault("rates", {})
+    cache.setdefault("readings", {})
+    return cache
 
 
-def send_reading_to_tado(tado, date, reading):
+def save_sent_cache(cache):
     """
-    Sends a meter reading to Tado using its Energy IQ feature.
+    Saves the record of rates and readings sent to Tado, replacing the file atomically.
     """
-    try:
-        result = tado.set_eiq_meter_readings(reading=int(reading), date=date)
-        print(f"Reading sent successfully for {date}: {result}")
-        return True
-    except Exception as e:
-        print(f"Error sending reading for {date}: {e}")
-        return False
+    tmp_path = SENT_CACHE_PATH.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, SENT_CACHE_PATH)
 
 
 def parse_args():
@@ -191,62 +207,86 @@ def parse_args():
         required=True,
         help="Long Product Code shown on your account API data",
     )
+    parser.add_argument(
+        "--payment-method",
+        choices=PAYMENT_METHODS,
+        default="DIRECT_DEBIT",
+        help="Which payment method's gas rates to send to Tado",
+    )
+
+    # Backfill options
+    parser.add_argument(
+        "--mode",
+        choices=["full", "latest"],
+        default="full",
+        help="Send a meter reading for every day (full), or only the most recent meter total (latest)",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(levelname)s: %(message)s",
+    )
     args = parse_args()
 
     # Login to Tado using browser method
-    print("Logging into Tado...")
+    logger.info("Logging into Tado...")
     tado = tado_login(username=args.tado_email, password=args.tado_password)
 
+    # Rates and readings sent by previous runs don't need sending again
+    sent_cache = load_sent_cache()
+
     # Get gas rates from Octopus Energy API
-    print("Fetching gas rates from Octopus Energy...")
+    logger.info("Fetching gas rates from Octopus Energy...")
     rates = get_gas_rates(args.octopus_api_key, args.short_code, args.long_code)
 
+    rates = filter_payment_method(rates, args.payment_method)
+
+    # Merge duplicate and back-to-back identical rates into as few periods as possible
+    rates = collapse_rates(rates)
+
     # Send rates to Tado
     if rates:
-        print(f"Sending {len(rates)} rates to Tado...")
-        for rate in rates:
-            try:
-                date_from = datetime.fromisoformat(rate["valid_from"]).strftime(
-                    "%Y-%m-%d"
-                )
-                date_to = datetime.fromisoformat(rate["valid_to"])
-                date_to = date_to - timedelta(days=1)
-                date_to = date_to.strftime("%Y-%m-%d")
-                send_rate_to_tado(tado, date_from, date_to, rate["value_inc_vat"])
-            except Exception as e:
-                print(f"Error processing rate: {e}")
-                continue
+        logger.info("Sending %d rates to Tado...", len(rates))
+        periods = rate_periods(rates)
+        send_rates_to_tado(tado, periods, sent_cache["rates"])
+        save_sent_cache(sent_cache)
     else:
-        print("No rates found to send")
+        logger.info("No rates found to send")
 
     # Get meter readings from Octopus Energy API
-    print("Fetching meter readings from Octopus Energy...")
+    logger.info("Fetching meter readings from Octopus Energy...")
     consumption = get_meter_reading_total_consumption(
         args.octopus_api_key, args.mprn, args.gas_serial_number
     )
 
     # Send meter readings to Tado
     if consumption:
-        print(f"Sending {len(consumption)} meter readings to Tado...")
-        sum_consumption = 0
-        for interval in consumption:
-            sum_consumption += interval["consumption"]
-            try:
-                print(
-                    f"Processing: {interval['interval_end']} - Consumption: {interval['consumption']} - Sum: {sum_consumption}"
-                )
-                send_reading_to_tado(tado, interval["interval_end"], sum_consumption)
-            except Exception as e:
-                print(
-                    f"Error processing meter reading for {interval.get('interval_end', 'unknown')}: {e}"
-                )
-                continue
+        # Tado expects the meter total on each day, i.e. a running sum of consumption
+        totals = itertools.accumulate(
+            interval["consumption"] for interval in consumption
+        )
+        readings = []
+        for interval, sum_consumption in zip(consumption, totals):
+            logger.debug(
+                "Processing: %s - Consumption: %s - Sum: %s",
+                interval["interval_end"],
+                interval["consumption"],
+                sum_consumption,
+            )
+            readings.append((interval["interval_end"], sum_consumption))
+
+        # Tado displays the latest total, the daily history only feeds its charts
+        if args.mode == "latest":
+            readings = readings[-1:]
+
+        logger.info("Sending %d meter readings to Tado...", len(readings))
+        send_readings_to_tado(tado, readings, sent_cache["readings"])
+        save_sent_cache(sent_cache)
     else:
-        print("No consumption data found to send")
+        logger.info("No consumption data found to send")
 
-    print("Backfill process completed!")
+    logger.info("Backfill process completed!")
@@ -0,0 +1,303 @@
+import functools
+import logging
+import math
+import orjson
+import os
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+CONSUMPTION_URL = "https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/"
+GAS_RATES_URL = "https://api.octopus.energy/v1/products/{short_code}/gas-tariffs/{long_code}/standard-unit-rates/"
+
+# Octopus returns 100 records per page unless asked for more
+CONSUMPTION_PAGE_SIZE = 1500
+OCTOPUS_TIMEOUT = (5, 30)
+PAYMENT_METHODS = ["DIRECT_DEBIT", "NON_DIRECT_DEBIT"]
+OCTOPUS_MAX_WORKERS = 8
+TADO_STORAGE_STATE_PATH = "/tmp/tado_storage.json"
+
+
+class OctopusApiError(Exception):
+    """
+    Raised when data can't be retrieved from the Octopus Energy API.
+    """
+
+
+_ONE_DAY = timedelta(days=1)
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        # One keep-alive connection per page worker, with workers waiting for a
+        # free connection rather than opening (and then discarding) extra ones
+        pool_maxsize=OCTOPUS_MAX_WORKERS,
+        pool_block=True,
+        # Ride out rate limiting and flaky gateways without losing pagination progress
+        max_retries=Retry(
+            total=6,
+            backoff_factor=1.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+def get_session():
+    """
+    Returns the shared HTTP session used for all Octopus Energy API calls.
+    """
+    return _SESSION
+
+
+def get_consumption_page(api_key, url, params):
+    """
+    Retrieves a single page of consumption data, returning None if the request fails.
+    """
+    try:
+        response = get_session().get(
+            url,
+            params=params,
+            auth=HTTPBasicAuth(api_key, ""),
+            timeout=OCTOPUS_TIMEOUT,
+        )
+
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+
+        logger.error(
+            "Failed to retrieve data. Status code: %s, Message: %s",
+            response.status_code,
+            response.text,
+        )
+    except Exception:
+        logger.exception("Error fetching meter readings")
+
+    return None
+
+
+def get_consumption_pages(api_key, mprn, gas_serial_number, **params):
+    """
+    Yields every page of consumption data for the given gas meter in order, filtered by the
+    given query parameters. The first page tells us how many pages there are, the remaining
+    pages are then fetched concurrently. Raises OctopusApiError at the first page that fails.
+    """
+    url = CONSUMPTION_URL.format(mprn=mprn, gas_serial_number=gas_serial_number)
+    params = {"page_size": CONSUMPTION_PAGE_SIZE, **params}
+
+    first_page = get_consumption_page(api_key, url, params)
+    if first_page is None:
+        raise OctopusApiError("Failed to retrieve the first page of consumption data")
+
+    yield first_page
+
+    page_size = len(first_page["results"])
+
+    if first_page.get("next") and page_size:
+        page_count = math.ceil(first_page["count"] / page_size)
+        page_params = [{**params, "page": page} for page in range(2, page_count + 1)]
+
+        executor = ThreadPoolExecutor(max_workers=OCTOPUS_MAX_WORKERS)
+        try:
+            futures = [
+                executor.submit(get_consumption_page, api_key, url, page_query)
+                for page_query in page_params
+            ]
+            for page_query, future in zip(page_params, futures):
+                page = future.result()
+                if page is None:
+                    raise OctopusApiError(
+                        f"Failed to retrieve page {page_query['page']} of consumption data"
+                    )
+                yield page
+        finally:
+            # Don't wait for (or keep fetching) pages we're going to throw away
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_gas_rates(api_key, short_code, long_code):
+    """
+    Retrieves all rates from the Octopus Energy API for the given gas product.
+    """
+    url = GAS_RATES_URL.format(short_code=short_code, long_code=long_code)
+    rates = []
+
+    try:
+        response = get_session().get(
+            url, auth=HTTPBasicAuth(api_key, ""), timeout=OCTOPUS_TIMEOUT
+        )
+
+        if response.status_code == 200:
+            rates_data = orjson.loads(response.content)
+            rates = rates_data["results"]
+        else:
+            logger.error(
+                "Failed to retrieve rates. Status code: %s, Message: %s",
+                response.status_code,
+                response.text,
+            )
+    except Exception:
+        logger.exception("Error fetching gas rates")
+
+    return rates
+
+
+def iso_to_ymd(timestamp):
+    """
+    Returns the YYYY-MM-DD date portion of an Octopus ISO 8601 timestamp.
+    """
+    return timestamp[:10]
+
+
+@functools.lru_cache(maxsize=4096)
+def iso_to_ymd_minus1(timestamp):
+    """
+    Returns the YYYY-MM-DD date the day before an Octopus ISO 8601 timestamp.
+    """
+    return (date.fromisoformat(timestamp[:10]) - _ONE_DAY).isoformat()
+
+
+def filter_payment_method(rates, payment_method):
+    """
+    Returns the rates for the given payment method. Octopus lists a price per payment method on
+    some tariffs but Tado can only hold one per period, rates without a payment method are kept.
+    """
+    return [
+        rate for rate in rates if rate.get("payment_method") in (None, payment_method)
+    ]
+
+
+def rate_period(rate):
+    """
+    Returns the (from, to) YYYY-MM-DD dates to send to Tado for an Octopus rate. The current
+    rate is open-ended (valid_to is None), so it is sent as running until today.
+    """
+    date_from = iso_to_ymd(rate["valid_from"])
+    if rate["valid_to"] is None:
+        return date_from, max(date_from, date.today().isoformat())
+    return date_from, iso_to_ymd_minus1(rate["valid_to"])
+
+
+async def browser_login(url, username, password):
+    """
+    Performs browser-based login to Tado using Playwright.
+    """
+    # Only pay for importing Playwright when a browser login is actually needed
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        # Screenshots are only useful when debugging the login flow
+        debug = bool(os.getenv("DEBUG_PLAYWRIGHT"))
+
+        browser = await p.chromium.launch(
+            headless=True,  # Set to False if you want a browser window
+            args=["--disable-dev-shm-usage", "--disable-gpu"],
+        )
+        # Reuse cookies from a previous sign-in so we can skip the login form
+        storage_state = None
+        if os.path.exists(TADO_STORAGE_STATE_PATH):
+            storage_state = TADO_STORAGE_STATE_PATH
+        context = await browser.new_context(storage_state=storage_state)
+        page = await context.new_page()
+
+        await page.goto(url)
+
+        # Click the "Submit" button before login
+        await page.wait_for_selector('text="Submit"', timeout=5000)
+        await page.click('text="Submit"')
+
+        # Wait for the login form, or the message screen if we're already signed in
+        message_screen = ".text-center.message-screen.b-bubble-screen__spaced"
+        await page.wait_for_selector(f'input[name="loginId"], {message_screen}')
+
+        if await page.query_selector('input[id="loginId"]'):
+            # Replace with actual selectors for your site
+            await page.fill('input[id="loginId"]', username)
+            await page.fill('input[name="password"]', password)
+
+            await page.click('button.c-btn--primary:has-text("Sign in")')
+
+            if debug:
+                await page.screenshot(path="screenshot.png")
+
+        await page.wait_for_selector(message_screen, timeout=10000)
+
+        if debug:
+            await page.screenshot(path="after-message.png")
+
+        await context.storage_state(path=TADO_STORAGE_STATE_PATH)
+        await browser.close()
+
+
+@functools.lru_cache(maxsize=1)
+def tado_login(username, password):
+    """
+    Logs into Tado using device activation with browser login if needed.
+    The client is cached, so repeated calls in one process share a single login.
+    """
+    from PyTado.interface import Tado
+
+    tado = Tado(token_file_path="/tmp/tado_refresh_token")
+
+    status = tado.device_activation_status()
+
+    if status == "PENDING":
+        import asyncio
+
+        url = tado.device_verification_url()
+
+        asyncio.run(browser_login(url, username, password))
+
+        tado.device_activation()
+
+        status = tado.device_activation_status()
+
+    if status == "COMPLETED":
+        logger.info("Login successful")
+    else:
+        logger.warning("Login status is %s", status)
+
+    return tado
+
+
+def send_rate_to_tado(tado, valid_from, valid_to, rate):
+    """
+    Sends a gas rate to Tado using its Energy IQ feature.
+    """
+    try:
+        result = tado.set_eiq_tariff(
+            from_date=valid_from,
+            to_date=valid_to,
+            is_period=True,
+            tariff=(rate / 100),
+            unit="kWh",
+        )
+        logger.debug(
+            "Rate sent successfully for %s to %s: %s", valid_from, valid_to, result
+        )
+        return True
+    except Exception:
+        logger.exception("Error sending rate for %s to %s", valid_from, valid_to)
+        return False
+
+
+def send_reading_to_tado(tado, reading_date, reading):
+    """
+    Sends a meter reading to Tado using its Energy IQ feature.
+    """
+    try:
+        result = tado.set_eiq_meter_readings(reading=int(reading), date=reading_date)
+        logger.debug("Reading sent successfully for %s: %s", reading_date, result)
+        return True
+    except Exception:
+        logger.exception("Error sending reading for %s", reading_date)
+        return False
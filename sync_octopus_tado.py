@@ -1,10 +1,21 @@
 import argparse
-import asyncio
-import requests
-from datetime import datetime, timedelta
-from requests.auth import HTTPBasicAuth
-from playwright.async_api import async_playwright
-from PyTado.interface import Tado
+import logging
+import os
+import sys
+from datetime import date, datetime, timezone
+from octopus_tado_common import (
+    PAYMENT_METHODS,
+    OctopusApiError,
+    filter_payment_method,
+    get_consumption_pages,
+    get_gas_rates,
+    rate_period,
+    send_rate_to_tado,
+    send_reading_to_tado,
+    tado_login,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def get_meter_reading_total_consumption(api_key, mprn, gas_serial_number):
@@ -12,138 +23,48 @@ def get_meter_reading_total_consumption(api_key, mprn, gas_serial_number):
     Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
     """
     period_from = datetime(2000, 1, 1, 0, 0, 0)
-    url = f"https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/?group_by=quarter&period_from={period_from.isoformat()}Z"
     total_consumption = 0.0
 
-    while url:
-        response = requests.get(url, auth=HTTPBasicAuth(api_key, ""))
-
-        if response.status_code == 200:
-            meter_readings = response.json()
-            total_consumption += sum(
-                interval["consumption"] for interval in meter_readings["results"]
-            )
-            url = meter_readings.get("next", "")
-        else:
-            print(
-                f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}"
-            )
-            break
-
-    print(f"Total consumption is {total_consumption}")
-    return total_consumption
-
-
-def get_gas_rates(api_key, short_code, long_code):
-    """
-    Retrieves all rates from the Octopus Energy API for the given gas product.
-    """
-    url = f"https://api.octopus.energy/v1/products/{short_code}/gas-tariffs/{long_code}/standard-unit-rates/"
-    rates = []
-
-    response = requests.get(url, auth=HTTPBasicAuth(api_key, ""))
-
-    if response.status_code == 200:
-        rates_data = response.json()
-        rates = rates_data["results"]
-
-    else:
-        print(
-            f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}"
-        )
-
-    return rates
-
-
-async def browser_login(url, username, password):
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True
-        )  # Set to True if you don't want a browser window
-        context = await browser.new_context()
-        page = await context.new_page()
-
-        await page.goto(url)
-
-        # Click the "Submit" button before login
-        await page.wait_for_selector('text="Submit"', timeout=5000)
-        await page.click('text="Submit"')
-
-        # Wait for the login form to appear
-        await page.wait_for_selector('input[name="loginId"]')
-
-        # Replace with actual selectors for your site
-        await page.fill('input[id="loginId"]', username)
-        await page.fill('input[name="password"]', password)
-
-        await page.click('button.c-btn--primary:has-text("Sign in")')
-
-        # Optionally take a screenshot
-        await page.screenshot(path="screenshot.png")
-
-        await page.wait_for_selector(
-            ".text-center.message-screen.b-bubble-screen__spaced", timeout=10000
+    for page in get_consumption_pages(
+        api_key,
+        mprn,
+        gas_serial_number,
+        group_by="quarter",
+        period_from=f"{period_from.isoformat()}Z",
+    ):
+        total_consumption += sum(
+            interval["consumption"] for interval in page["results"]
         )
 
-        # Take a screenshot (optional)
-        await page.screenshot(path="after-message.png")
-        await browser.close()
-
-
-def tado_login(username, password):
-    tado = Tado(token_file_path="/tmp/tado_refresh_token")
-
-    status = tado.device_activation_status()
-
-    if status == "PENDING":
-        url = tado.device_verification_url()
-
-        asyncio.run(browser_login(url, username, password))
-
-        tado.device_activation()
-
-        status = tado.device_activation_status()
-
-    if status == "COMPLETED":
-        print("Login successful")
-    else:
-        print(f"Login status is {status}")
-
-    return tado
+    logger.info("Total consumption is %s", total_consumption)
+    return total_consumption
 
 
-def send_rate_to_tado(tado, valid_from, valid_to, rate):
+def send_current_rate_to_tado(tado, rates, payment_method):
     """
-    Sends the total consumption reading to Tado using its Energy IQ feature.
+    Sends the current gas rate for the given payment method to Tado, returning False if it couldn't be sent.
     """
-    result = tado.set_eiq_tariff(
-        from_date=valid_from,
-        to_date=valid_to,
-        is_period=True,
-        tariff=(rate / 100),
-        unit="kWh",
-    )
-    print(result)
-
-
-def send_reading_to_tado(username, password, reading, rates):
+    now = datetime.now(timezone.utc)
+    started = [
+        rate
+        for rate in filter_payment_method(rates, payment_method)
+        if _parse_timestamp(rate["valid_from"]) <= now
+    ]
+    if not started:
+        logger.info("No current rate found to send")
+        return True
+
+    # The most recently started rate is the only one a daily sync needs to send
+    rate = max(started, key=lambda rate: _parse_timestamp(rate["valid_from"]))
+    date_from, date_to = rate_period(rate)
+    return send_rate_to_tado(tado, date_from, date_to, rate["value_inc_vat"])
+
+
+def _parse_timestamp(timestamp):
     """
-    Sends the total consumption reading to Tado using its Energy IQ feature.
+    Parses an Octopus ISO 8601 timestamp, which may use a Z suffix for UTC.
     """
-
-    tado = tado_login(username=username, password=password)
-
-    result = tado.set_eiq_meter_readings(reading=int(reading))
-    print(result)
-
-    for rate in rates:
-        date_from = datetime.fromisoformat(rate["valid_from"]).strftime("%Y-%m-%d")
-        date_to = datetime.fromisoformat(rate["valid_to"])
-        date_to = date_to - timedelta(days=1)
-        date_to = date_to.strftime("%Y-%m-%d")
-        send_rate_to_tado(tado, date_from, date_to, rate["value_inc_vat"])
-        break
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
 
 
 def parse_args():
@@ -180,19 +101,42 @@ def parse_args():
         required=True,
         help="Long Product Code shown on your account API data",
     )
+    parser.add_argument(
+        "--payment-method",
+        choices=PAYMENT_METHODS,
+        default="DIRECT_DEBIT",
+        help="Which payment method's gas rate to send to Tado",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(levelname)s: %(message)s",
+    )
     args = parse_args()
 
-    # Get total consumption from Octopus Energy API
-    consumption = get_meter_reading_total_consumption(
-        args.octopus_api_key, args.mprn, args.gas_serial_number
-    )
+    # Get total consumption from Octopus Energy API. A partial total would be sent
+    # to Tado as a wrong meter reading, so give up if any of it is missing.
+    try:
+        consumption = get_meter_reading_total_consumption(
+            args.octopus_api_key, args.mprn, args.gas_serial_number
+        )
+    except OctopusApiError as e:
+        logger.error("%s, no reading sent to Tado", e)
+        sys.exit(1)
 
     rates = get_gas_rates(args.octopus_api_key, args.short_code, args.long_code)
 
+    tado = tado_login(username=args.tado_email, password=args.tado_password)
+
     # Send the total consumption to Tado
-    send_reading_to_tado(args.tado_email, args.tado_password, consumption, rates)
+    sent = send_reading_to_tado(tado, date.today().isoformat(), consumption)
+
+    sent &= send_current_rate_to_tado(tado, rates, args.payment_method)
+
+    # Fail the run so a broken sync shows up in the workflow history
+    if not sent:
+        sys.exit(1)
@@ -0,0 +1,173 @@
+import json
+import os
+from datetime import date
+
+import pytest
+
+import backfill_by_day
+from backfill_by_day import (
+    collapse_rates,
+    load_sent_cache,
+    rate_periods,
+    save_sent_cache,
+    send_rates_to_tado,
+    send_readings_to_tado,
+)
+
+
+class StubTado:
+    """
+    Records the readings and tariffs sent to it, failing for any date in fail_dates.
+    """
+
+    def __init__(self, fail_dates=()):
+        self.fail_dates = set(fail_dates)
+        self.readings = []
+        self.tariffs = []
+
+    def set_eiq_meter_readings(self, reading, date):
+        if date in self.fail_dates:
+            raise RuntimeError("Tado said no")
+        self.readings.append((date, reading))
+
+    def set_eiq_tariff(self, from_date, to_date, is_period, tariff, unit):
+        if from_date in self.fail_dates:
+            raise RuntimeError("Tado said no")
+        self.tariffs.append((from_date, to_date, tariff))
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "tado_sent_cache.json"
+    monkeypatch.setattr(backfill_by_day, "SENT_CACHE_PATH", path)
+    return path
+
+
+def rate(valid_from, valid_to, value, payment_method=None):
+    return {
+        "valid_from": valid_from,
+        "valid_to": valid_to,
+        "value_inc_vat": value,
+        "payment_method": payment_method,
+    }
+
+
+def test_collapse_rates_merges_adjacent_identical_rates():
+    rates = [
+        rate("2024-02-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.0),
+        rate("2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z", 5.0),
+        rate("2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z", 5.0),
+    ]
+
+    assert collapse_rates(rates) == [
+        rate("2024-01-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.0),
+    ]
+
+
+def test_collapse_rates_keeps_open_ended_rate_separate():
+    rates = [
+        rate("2024-04-01T00:00:00Z", None, 5.0),
+        rate("2024-01-01T00:00:00Z", "2024-04-01T00:00:00Z", 5.0),
+    ]
+
+    assert collapse_rates(rates) == [
+        rate("2024-01-01T00:00:00Z", "2024-04-01T00:00:00Z", 5.0),
+        rate("2024-04-01T00:00:00Z", None, 5.0),
+    ]
+
+
+def test_collapse_rates_merges_each_payment_method_separately():
+    rates = [
+        rate("2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z", 5.0, "DIRECT_DEBIT"),
+        rate("2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z", 5.5, "NON_DIRECT_DEBIT"),
+        rate("2024-02-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.0, "DIRECT_DEBIT"),
+        rate("2024-02-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.5, "NON_DIRECT_DEBIT"),
+    ]
+
+    assert collapse_rates(rates) == [
+        rate("2024-01-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.0, "DIRECT_DEBIT"),
+        rate("2024-01-01T00:00:00Z", "2024-03-01T00:00:00Z", 5.5, "NON_DIRECT_DEBIT"),
+    ]
+
+
+def test_rate_periods_sends_open_ended_rate_until_today():
+    rates = collapse_rates(
+        [
+            rate("2024-04-01T00:00:00Z", None, 5.0, "DIRECT_DEBIT"),
+            rate("2024-01-01T00:00:00Z", "2024-04-01T00:00:00Z", 5.0, "DIRECT_DEBIT"),
+        ]
+    )
+
+    assert rate_periods(rates) == [
+        ("2024-01-01", "2024-03-31", 5.0, "DIRECT_DEBIT"),
+        ("2024-04-01", date.today().isoformat(), 5.0, "DIRECT_DEBIT"),
+    ]
+
+
+def test_load_sent_cache_without_a_file(cache_path):
+    assert load_sent_cache() == {"rates": {}, "readings": {}}
+
+
+def test_load_sent_cache_with_a_corrupt_file(cache_path):
+    cache_path.write_text("{not json")
+
+    assert load_sent_cache() == {"rates": {}, "readings": {}}
+
+
+def test_save_sent_cache_replaces_the_file_atomically(cache_path, monkeypatch):
+    cache_path.write_text(json.dumps({"rates": {}, "readings": {"old": 1}}))
+    replaced = []
+    real_replace = os.replace
+
+    def replace(src, dst):
+        replaced.append((src, dst))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(backfill_by_day.os, "replace", replace)
+
+    save_sent_cache({"rates": {}, "readings": {"2024-01-01": 5}})
+
+    assert replaced == [(cache_path.with_suffix(".tmp"), cache_path)]
+    assert not cache_path.with_suffix(".tmp").exists()
+    assert load_sent_cache() == {"rates": {}, "readings": {"2024-01-01": 5}}
+
+
+def test_send_readings_to_tado_skips_readings_already_sent():
+    tado = StubTado()
+    sent = {"2024-01-01": 5, "2024-01-02": 7}
+
+    send_readings_to_tado(tado, [("2024-01-01", 5.4), ("2024-01-02", 8.1)], sent)
+
+    assert tado.readings == [("2024-01-02", 8)]
+    assert sent == {"2024-01-01": 5, "2024-01-02": 8}
+
+
+def test_send_readings_to_tado_does_not_record_failed_sends():
+    tado = StubTado(fail_dates={"2024-01-01"})
+    sent = {}
+
+    send_readings_to_tado(tado, [("2024-01-01", 5), ("2024-01-02", 7)], sent)
+
+    assert tado.readings == [("2024-01-02", 7)]
+    assert sent == {"2024-01-02": 7}
+
+
+def test_send_rates_to_tado_resends_changed_rates_only():
+    tado = StubTado(fail_dates={"2024-03-01"})
+    sent = {
+        "2024-01-01/2024-01-31/DIRECT_DEBIT": 5.0,
+        "2024-02-01/2024-02-29/DIRECT_DEBIT": 5.0,
+    }
+    periods = [
+        ("2024-01-01", "2024-01-31", 5.0, "DIRECT_DEBIT"),
+        ("2024-02-01", "2024-02-29", 6.0, "DIRECT_DEBIT"),
+        ("2024-03-01", "2024-03-31", 6.0, "DIRECT_DEBIT"),
+    ]
+
+    send_rates_to_tado(tado, periods, sent)
+
+    assert tado.tariffs == [("2024-02-01", "2024-02-29", 0.06)]
+    assert sent == {
+        "2024-01-01/2024-01-31/DIRECT_DEBIT": 5.0,
+        "2024-02-01/2024-02-29/DIRECT_DEBIT": 6.0,
+    }
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import octopus_tado_common
+from octopus_tado_common import OctopusApiError, get_consumption_pages, rate_period
+
+
+def stub_pages(monkeypatch, count, page_size, fail_page=None, delay=None):
+    """
+    Replaces get_consumption_page with one serving count records, page_size at a time,
+    and returns the list of page numbers requested.
+    """
+    requested = []
+    lock = threading.Lock()
+
+    def get_consumption_page(api_key, url, params):
+        page = params.get("page", 1)
+        with lock:
+            requested.append(page)
+        if delay:
+            time.sleep(delay(page))
+        if page == fail_page:
+            return None
+
+        start = (page - 1) * page_size
+        results = [{"page": page} for _ in range(start, min(start + page_size, count))]
+        has_next = start + page_size < count
+        return {
+            "count": count,
+            "next": "next" if has_next else None,
+            "results": results,
+        }
+
+    monkeypatch.setattr(
+        octopus_tado_common, "get_consumption_page", get_consumption_page
+    )
+    return requested
+
+
+def test_rate_period_ends_the_day_before_valid_to():
+    rate = {"valid_from": "2024-01-01T00:00:00Z", "valid_to": "2024-04-01T00:00:00Z"}
+
+    assert rate_period(rate) == ("2024-01-01", "2024-03-31")
+
+
+def test_rate_period_runs_open_ended_rate_until_today():
+    rate = {"valid_from": "2024-01-01T00:00:00Z", "valid_to": None}
+
+    assert rate_period(rate) == ("2024-01-01", date.today().isoformat())
+
+
+def test_rate_period_never_ends_before_it_starts():
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    rate = {"valid_from": f"{tomorrow}T00:00:00Z", "valid_to": None}
+
+    assert rate_period(rate) == (tomorrow, tomorrow)
+
+
+def test_get_consumption_pages_keeps_pages_in_order(monkeypatch):
+    # Later pages finish first
+    stub_pages(monkeypatch, count=50, page_size=10, delay=lambda page: 0.05 / page)
+
+    pages = list(get_consumption_pages("key", "mprn", "serial"))
+
+    assert [page["results"][0]["page"] for page in pages] == [1, 2, 3, 4, 5]
+
+
+def test_get_consumption_pages_stops_at_first_failed_page(monkeypatch):
+    requested = stub_pages(
+        monkeypatch,
+        count=400,
+        page_size=10,
+        fail_page=2,
+        delay=lambda page: 0 if page <= 2 else 0.2,
+    )
+
+    pages = []
+    with pytest.raises(OctopusApiError):
+        for page in get_consumption_pages("key", "mprn", "serial"):
+            pages.append(page)
+
+    assert [page["results"][0]["page"] for page in pages] == [1]
+    # Pages still queued behind the failure are cancelled, not fetched
+    assert len(requested) < 40
+
+
+def test_get_consumption_pages_fetches_last_short_page(monkeypatch):
+    requested = stub_pages(monkeypatch, count=25, page_size=10)
+
+    pages = list(get_consumption_pages("key", "mprn", "serial"))
+
+    assert sorted(requested) == [1, 2, 3]
+    assert [len(page["results"]) for page in pages] == [10, 10, 5]
+
+
+def test_get_consumption_pages_single_page(monkeypatch):
+    class Response:
+        status_code = 200
+        content = json.dumps(
+            {"count": 2, "next": None, "results": [{"consumption": 1.0}] * 2}
+        ).encode()
+
+    class Session:
+        def __init__(self):
+            self.calls = []
+
+        def get(self, url, params, auth, timeout):
+            self.calls.append((url, params))
+            return Response()
+
+    session = Session()
+    monkeypatch.setattr(octopus_tado_common, "get_session", lambda: session)
+
+    pages = list(get_consumption_pages("key", "mprn", "serial", group_by="day"))
+
+    assert len(pages) == 1
+    assert session.calls == [
+        (
+            "https://api.octopus.energy/v1/gas-meter-points/mprn/meters/serial/consumption/",
+            {"page_size": 1500, "group_by": "day"},
+        )
+    ]
@@ -0,0 +1,85 @@
+from datetime import date, timedelta
+
+import pytest
+
+import octopus_tado_common
+from octopus_tado_common import OctopusApiError
+from sync_octopus_tado import (
+    get_meter_reading_total_consumption,
+    send_current_rate_to_tado,
+)
+
+
+class StubTado:
+    def __init__(self):
+        self.tariffs = []
+
+    def set_eiq_tariff(self, from_date, to_date, is_period, tariff, unit):
+        self.tariffs.append((from_date, to_date, tariff))
+
+
+def rate(valid_from, valid_to, value, payment_method=None):
+    return {
+        "valid_from": valid_from,
+        "valid_to": valid_to,
+        "value_inc_vat": value,
+        "payment_method": payment_method,
+    }
+
+
+def test_send_current_rate_to_tado_sends_open_ended_rate_until_today():
+    tado = StubTado()
+    rates = [
+        rate("2024-04-01T00:00:00Z", None, 5.0),
+        rate("2024-01-01T00:00:00Z", "2024-04-01T00:00:00Z", 6.0),
+    ]
+
+    assert send_current_rate_to_tado(tado, rates, "DIRECT_DEBIT")
+    assert tado.tariffs == [("2024-04-01", date.today().isoformat(), 0.05)]
+
+
+def test_send_current_rate_to_tado_uses_the_requested_payment_method():
+    tado = StubTado()
+    rates = [
+        rate("2024-04-01T00:00:00Z", None, 5.5, "NON_DIRECT_DEBIT"),
+        rate("2024-04-01T00:00:00Z", None, 5.0, "DIRECT_DEBIT"),
+        rate("2024-01-01T00:00:00Z", "2024-04-01T00:00:00Z", 6.0, "DIRECT_DEBIT"),
+    ]
+
+    assert send_current_rate_to_tado(tado, rates, "DIRECT_DEBIT")
+    assert tado.tariffs == [("2024-04-01", date.today().isoformat(), 0.05)]
+
+
+def test_send_current_rate_to_tado_skips_rates_that_have_not_started():
+    tado = StubTado()
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    rates = [
+        rate(f"{tomorrow}T00:00:00Z", None, 7.0),
+        rate("2024-01-01T00:00:00Z", f"{tomorrow}T00:00:00Z", 6.0),
+    ]
+
+    assert send_current_rate_to_tado(tado, rates, "DIRECT_DEBIT")
+    assert tado.tariffs == [("2024-01-01", date.today().isoformat(), 0.06)]
+
+
+def test_send_current_rate_to_tado_without_rates():
+    tado = StubTado()
+
+    assert send_current_rate_to_tado(tado, [], "DIRECT_DEBIT")
+    assert tado.tariffs == []
+
+
+def test_get_meter_reading_total_consumption_fails_rather_than_undercounting(
+    monkeypatch,
+):
+    def get_consumption_page(api_key, url, params):
+        if params.get("page") == 3:
+            return None
+        return {"count": 30, "next": "next", "results": [{"consumption": 1.0}] * 10}
+
+    monkeypatch.setattr(
+        octopus_tado_common, "get_consumption_page", get_consumption_page
+    )
+
+    with pytest.raises(OctopusApiError):
+        get_meter_reading_total_consumption("key", "mprn", "serial")